@@ -1,6 +1,6 @@
 # app.py
 from flask import Flask, send_file, jsonify, Response
-import os, io, json
+import os, io, json, gzip, hashlib, tempfile, threading
 from pathlib import Path
 
 # ---- plotting deps (server-side) ----
@@ -11,6 +11,7 @@ import pandas as pd
 import matplotlib
 matplotlib.use("Agg")  # headless
 import matplotlib.pyplot as plt
+from PIL import Image  # installed with matplotlib; reads the plot's source tag
 
 app = Flask(__name__, static_folder='.', static_url_path='')
 
@@ -45,6 +46,8 @@ def _json_for_request(state_or_file: str | None) -> Path:
     return _resolve(JSON_FILE)
 
 
+DEFAULT_JSON = ALLOWED_JSON["mi"]
+JSON_FILE = os.environ.get('JSON_FILE', DEFAULT_JSON)
 MI_CSV   = os.environ.get('MI_INPUT_CSV', 'mi_data_output.csv')
 PLOT_PNG = os.environ.get('MI_PLOT_PNG', 'statewide_margin_pct_vs_percent_in_mi.png')
 
@@ -53,6 +56,20 @@ def _resolve(path_like: str) -> Path:
     p = Path(path_like)
     return p if p.is_absolute() else Path.cwd() / p
 
+# Raw JSON bodies keyed by path -> (mtime_ns, bytes, gzipped bytes); files are served as-is
+_JSON_CACHE: dict[Path, tuple[int, bytes, bytes]] = {}
+
+def _json_entry(jp: Path) -> tuple[int, bytes, bytes]:
+    mtime = jp.stat().st_mtime_ns
+    hit = _JSON_CACHE.get(jp)
+    if hit is not None and hit[0] == mtime:
+        return hit
+    body = jp.read_bytes()
+    json.loads(body)  # validate once per file version instead of per request
+    gz = gzip.compress(body, compresslevel=6, mtime=0)  # compress once, not per response
+    _JSON_CACHE[jp] = hit = (mtime, body, gz)
+    return hit
+
 # ======== Left pane (existing) ========
 @app.route("/")
 def root():
@@ -69,11 +86,19 @@ def data():
     if not jp.exists():
         return jsonify({"error": f"JSON not found at {str(jp)}"}), 404
     try:
-        with jp.open("r", encoding="utf-8") as f:
-            payload = json.load(f)
+        mtime, body, gz = _json_entry(jp)
     except Exception as e:
         return jsonify({"error": f"Failed to read JSON: {e}"}), 500
-    return jsonify(payload)
+    if request.accept_encodings["gzip"]:
+        resp = Response(gz, mimetype="application/json")
+        resp.headers["Content-Encoding"] = "gzip"
+    else:
+        resp = Response(body, mimetype="application/json")
+    resp.vary.add("Accept-Encoding")
+    # Polling tabs revalidate and get an empty 304 until the file changes
+    resp.set_etag(f"{mtime:x}", weak=True)
+    resp.cache_control.no_cache = True
+    return resp.make_conditional(request)
 
 
 @app.route("/health")
@@ -88,21 +113,33 @@ def _to_num(s, default=np.nan):
         s = s.fillna(default)
     return s
 
+def _lower_columns(df: pd.DataFrame) -> dict:
+    # {lowercased name: [original names in frame order]}; callers probe names
+    # in their own priority order, not the CSV's column order
+    low = {}
+    for c in df.columns:
+        low.setdefault(str(c).lower(), []).append(c)
+    return low
+
+def _first_column(low: dict, names):
+    return next((low[n][0] for n in names if n in low), None)
+
 def find_statewide_percent_in_column(df: pd.DataFrame):
     candidates = [
         "state_eevp","statewide_eevp","eevp_statewide",
         "percent_in_statewide","state_percent_in","statewide_percent_in",
         "statewide_percent","statewide%in","statewide_pct_in"
     ]
-    for c in df.columns:
-        if c.lower() in candidates:
-            s = _to_num(df[c])
-            m = s.max() if s.notna().any() else None
-            if m is not None and m <= 1.5:
-                s = s * 100.0
-            return (s.clip(lower=0, upper=100), c)
-    loose = [c for c in df.columns if c.lower() in ("percent_in","eevp")]
-    for c in loose:
+    low = _lower_columns(df)
+    c = _first_column(low, candidates)
+    if c is not None:
+        s = _to_num(df[c])
+        m = s.max() if s.notna().any() else None
+        if m is not None and m <= 1.5:
+            s = s * 100.0
+        return (s.clip(lower=0, upper=100), c)
+    # Loose names: fall through to the next matching column if one is all-NaN
+    for c in [c for key in ("percent_in","eevp") for c in low.get(key, ())]:
         s = _to_num(df[c])
         if s.notna().any():
             m = s.max()
@@ -112,18 +149,19 @@ def find_statewide_percent_in_column(df: pd.DataFrame):
     return (None, None)
 
 def derive_statewide_votes(df: pd.DataFrame):
-    hv_col = next((c for c in df.columns if c.lower() in ("harris_votes_statewide","statewide_harris_votes")), None)
-    tv_col = next((c for c in df.columns if c.lower() in ("trump_votes_statewide","statewide_trump_votes")), None)
-    ov_col = next((c for c in df.columns if c.lower() in ("other_votes_statewide","statewide_other_votes")), None)
+    low = _lower_columns(df)
+    hv_col = _first_column(low, ("harris_votes_statewide","statewide_harris_votes"))
+    tv_col = _first_column(low, ("trump_votes_statewide","statewide_trump_votes"))
+    ov_col = _first_column(low, ("other_votes_statewide","statewide_other_votes"))
     if hv_col and tv_col and ov_col:
         h = _to_num(df[hv_col], 0.0)
         t = _to_num(df[tv_col], 0.0)
         o = _to_num(df[ov_col], 0.0)
         return h, t, (h + t + o)
 
-    h_snap = next((c for c in df.columns if c.lower() in ("harris_votes","harris_snapshot_votes","h_votes")), None)
-    t_snap = next((c for c in df.columns if c.lower() in ("trump_votes","trump_snapshot_votes","t_votes")), None)
-    o_snap = next((c for c in df.columns if c.lower() in ("other_votes","other_snapshot_votes","o_votes")), None)
+    h_snap = _first_column(low, ("harris_votes","harris_snapshot_votes","h_votes"))
+    t_snap = _first_column(low, ("trump_votes","trump_snapshot_votes","t_votes"))
+    o_snap = _first_column(low, ("other_votes","other_snapshot_votes","o_votes"))
     if h_snap and t_snap and o_snap:
         h = _to_num(df[h_snap], 0.0)
         t = _to_num(df[t_snap], 0.0)
@@ -138,30 +176,37 @@ def statewide_margin_pct_by_percent_in(df: pd.DataFrame):
     sw, _ = find_statewide_percent_in_column(df)
     if sw is None:
         return np.array([]), np.array([])
-    df = df.copy()
-    df["__x__"] = _to_num(sw).round(3)
-    df = df.loc[df["__x__"] > 0].copy()
-    if df.empty: return np.array([]), np.array([])
+    x = _to_num(sw).round(3).to_numpy(dtype=float)
+    keep = x > 0
+    if not keep.any(): return np.array([]), np.array([])
 
     hv, tv, tot = derive_statewide_votes(df)
     if hv.isna().all() or tv.isna().all(): return np.array([]), np.array([])
 
-    vt = pd.DataFrame({"x": df["__x__"], "hv": hv, "tv": tv}).dropna()
-    if vt.empty: return np.array([]), np.array([])
-
-    has_statewide_cols = any(c.lower() == "harris_votes_statewide" for c in df.columns) \
-                         or any(c.lower() == "statewide_harris_votes" for c in df.columns)
+    # Group by x on plain arrays: np.unique gives sorted keys, bincount sums per key
+    h = hv.to_numpy(dtype=float)
+    t = tv.to_numpy(dtype=float)
+    keep &= ~(np.isnan(h) | np.isnan(t))
+    if not keep.any(): return np.array([]), np.array([])
+    x, h, t = x[keep], h[keep], t[keep]
+    ux, inv = np.unique(x, return_inverse=True)
+    h_sum = np.bincount(inv, weights=h)
+    t_sum = np.bincount(inv, weights=t)
+
+    low = _lower_columns(df)
+    has_statewide_cols = "harris_votes_statewide" in low or "statewide_harris_votes" in low
     if has_statewide_cols:
-        vt = vt.groupby("x", as_index=False)[["hv","tv"]].mean().sort_values("x")
-    else:
-        vt = vt.groupby("x", as_index=False)[["hv","tv"]].sum().sort_values("x")
+        # statewide totals repeat on every row of a snapshot -> average, don't sum
+        n = np.bincount(inv)
+        h_sum /= n
+        t_sum /= n
 
     with np.errstate(divide="ignore", invalid="ignore"):
-        total = (vt["hv"] + vt["tv"]).to_numpy(dtype=float)
-        h_pct = np.where(total > 0, (vt["hv"].to_numpy(dtype=float) / total) * 100.0, np.nan)
-        t_pct = np.where(total > 0, (vt["tv"].to_numpy(dtype=float) / total) * 100.0, np.nan)
+        total = h_sum + t_sum
+        h_pct = np.where(total > 0, (h_sum / total) * 100.0, np.nan)
+        t_pct = np.where(total > 0, (t_sum / total) * 100.0, np.nan)
         margin_pct = h_pct - t_pct  # Harris% − Trump%
-    return vt["x"].to_numpy(dtype=float), margin_pct
+    return ux, margin_pct
 
 def build_valid_mask(df: pd.DataFrame):
     sw, _ = find_statewide_percent_in_column(df)
@@ -169,20 +214,20 @@ def build_valid_mask(df: pd.DataFrame):
         return pd.Series(False, index=df.index)
     return _to_num(sw, 0.0) > 0
 
-def generate_mi_plot(csv_path: Path, out_png: Path) -> bool:
-    if not csv_path.exists(): return False
+def generate_mi_plot(csv_path: Path, out_png: Path, source: str | None = None) -> bytes | None:
+    if not csv_path.exists(): return None
     try:
         df = pd.read_csv(csv_path)
     except Exception:
-        return False
+        return None
 
     mask = build_valid_mask(df)
     df = df.loc[mask].copy()
-    if df.empty: return False
+    if df.empty: return None
 
     # X and statewide margin pct series (right axis)
     x_v, margin_pct = statewide_margin_pct_by_percent_in(df)
-    if len(x_v) == 0: return False
+    if len(x_v) == 0: return None
 
     # Optional: If you have leader/trailer series, you can layer them in too.
     # For now, mimic your uploaded MI plot — line for margin and the scatter overlays:
@@ -191,12 +236,13 @@ def generate_mi_plot(csv_path: Path, out_png: Path) -> bool:
     fig, ax1 = plt.subplots(figsize=(12, 6))
 
     # Try to plot “leader” and “trailer” confidences if present (columns like you use elsewhere)
+    low = _lower_columns(df)
+    xsw, _ = find_statewide_percent_in_column(df)
+    x = _to_num(xsw).round(3).to_numpy() if xsw is not None else None
     def maybe_scatter(prefix, color, marker, alpha):
-        ycols = [c for c in df.columns if c.lower().startswith(prefix)]
-        xsw, _ = find_statewide_percent_in_column(df)
-        if len(ycols) == 0 or xsw is None: return
-        x = _to_num(xsw).round(3).to_numpy()
-        y = _to_num(df[ycols[0]]).to_numpy()
+        ycol = next((cols[0] for k, cols in low.items() if k.startswith(prefix)), None)
+        if ycol is None or x is None: return
+        y = _to_num(df[ycol]).to_numpy()
         good = np.isfinite(x) & np.isfinite(y) & (x > 0)
         if good.any():
             ax1.scatter(x[good], y[good], s=28, c=color, marker=marker, alpha=alpha, edgecolor="none")
@@ -221,32 +267,126 @@ def generate_mi_plot(csv_path: Path, out_png: Path) -> bool:
     ax1.set_title("MI 2024 Presidential Race")
 
     fig.tight_layout()
-    fig.savefig(out_png, dpi=200)
+    buf = io.BytesIO()
+    # `source` is stored as a PNG text chunk so a later reader can tell which CSV version this is
+    fig.savefig(buf, format="png", dpi=200, metadata={"Source": source} if source else None)
     plt.close(fig)
+    png = buf.getvalue()
+    _write_atomic(out_png, png)
+    return png
+
+# mkstemp creates files 0600; read the umask once so outputs get the usual open() mode
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def _write_atomic(path: Path, data: bytes):
+    # temp file in the same directory + os.replace: readers never see a partial file
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp, 0o666 & ~_UMASK)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+# Rendered PNG bytes keyed by (csv path, csv mtime_ns); only the latest key is kept
+_PLOT_CACHE: dict[tuple, bytes] = {}
+# pyplot is not thread-safe; also makes concurrent misses render only once
+_PLOT_LOCK = threading.Lock()
+
+def _plot_key(csv_path: Path):
+    try:
+        return (str(csv_path), csv_path.stat().st_mtime_ns)
+    except OSError:
+        return None
+
+def _plot_source(key) -> str:
+    # ASCII tag for a (csv path, mtime_ns) key, embedded in the rendered PNG
+    path_hash = hashlib.sha1(os.fsencode(key[0])).hexdigest()[:16]
+    return f"{path_hash}:{key[1]:x}"
+
+def _png_source(png: bytes):
+    # Our "Source" text chunk; verify() walks every chunk CRC, so a truncated file yields None
+    try:
+        im = Image.open(io.BytesIO(png))
+        source = im.info.get("Source")
+        im.verify()
+    except Exception:
+        return None
+    return source
+
+def _rebuild_plot(csv_path: Path, out_png: Path):
+    """
+    Render and cache the plot. Returns (key, png bytes), or None if it can't be built.
+    The CSV may be rewritten mid-render, so a render is only cached when the CSV's
+    mtime is the same before and after; otherwise render again. If it keeps moving,
+    the last render is returned uncached with key None.
+    """
+    _PLOT_CACHE.clear()
+    png = None
+    for _ in range(3):
+        key = _plot_key(csv_path)
+        png = generate_mi_plot(csv_path, out_png, _plot_source(key)) if key is not None else None
+        if png is None:
+            return None
+        if _plot_key(csv_path) == key:
+            _PLOT_CACHE[key] = png
+            return key, png
+    return None, png
+
+def _load_plot_from_disk(out_png: Path, key) -> bool:
+    # Reuse a PNG rendered from this exact CSV version (e.g. after a restart, or by
+    # another worker). Renders are written atomically and tagged with their source key.
+    try:
+        png = out_png.read_bytes()
+    except OSError:
+        return False
+    if _png_source(png) != _plot_source(key):
+        return False
+    _PLOT_CACHE.clear()
+    _PLOT_CACHE[key] = png
     return True
 
 @app.route("/plot.png")
 def serve_plot():
-    # Generate (or overwrite) and return the PNG
-    ok = generate_mi_plot(_resolve(MI_CSV), _resolve(PLOT_PNG))
-    if not ok:
-        # Return a small placeholder PNG with a message
-        fig, ax = plt.subplots(figsize=(6, 2))
-        ax.axis('off')
-        ax.text(0.02, 0.5, f"Could not build plot.\nLooking for: {MI_CSV}", va='center', ha='left')
-        buf = io.BytesIO()
-        fig.savefig(buf, format="png", dpi=160, bbox_inches="tight")
-        plt.close(fig)
-        buf.seek(0)
-        return Response(buf.read(), mimetype="image/png")
-
-    return send_file(str(_resolve(PLOT_PNG)), mimetype="image/png", max_age=0)
+    # Rebuild only when the CSV changed since the last render
+    csv_path, out_png = _resolve(MI_CSV), _resolve(PLOT_PNG)
+    with _PLOT_LOCK:
+        key = _plot_key(csv_path)
+        if key is not None and (key in _PLOT_CACHE or _load_plot_from_disk(out_png, key)):
+            built = (key, _PLOT_CACHE[key])
+        else:
+            built = _rebuild_plot(csv_path, out_png)
+        if built is None:
+            # Return a small placeholder PNG with a message
+            fig, ax = plt.subplots(figsize=(6, 2))
+            ax.axis('off')
+            ax.text(0.02, 0.5, f"Could not build plot.\nLooking for: {MI_CSV}", va='center', ha='left')
+            buf = io.BytesIO()
+            fig.savefig(buf, format="png", dpi=160, bbox_inches="tight")
+            plt.close(fig)
+            buf.seek(0)
+            return Response(buf.read(), mimetype="image/png")
+
+    key, png = built
+    resp = Response(png, mimetype="image/png")
+    resp.cache_control.no_cache = True
+    if key is None:
+        return resp  # CSV kept changing during render; nothing stable to tag
+    resp.set_etag(f"{key[1]:x}", weak=True)
+    return resp.make_conditional(request)
 
 @app.route("/replot", methods=["POST", "GET"])
 def replot():
     # Force a rebuild and return a JSON ok for the client to refresh <img> src
-    ok = generate_mi_plot(_resolve(MI_CSV), _resolve(PLOT_PNG))
-    return jsonify({"ok": bool(ok)})
+    with _PLOT_LOCK:
+        built = _rebuild_plot(_resolve(MI_CSV), _resolve(PLOT_PNG))
+    return jsonify({"ok": built is not None})
 
 if __name__ == "__main__":
     # Run: python app.py